@@ -1,26 +1,81 @@
 import asyncio
+import copy
+import hashlib
 import json
 import re
 import time
-import base64
-import io
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Any, Tuple
+from collections import OrderedDict
 import logging
 from dataclasses import dataclass, asdict
 from enum import Enum
 import os
 from pathlib import Path
+import queue
 import shutil
+import threading
 
 # External dependencies
-from playwright.async_api import async_playwright, Page, Browser, BrowserContext
-import streamlit as st
-from PIL import Image
-import requests
+# Playwright is imported where it is first needed so the agent and client
+# classes load quickly (and without a browser install) when the UI isn't used
+import httpx
+import orjson
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+try:
+    import streamlit as st
+except ImportError:  # Allow importing the agent classes without Streamlit
+    st = None
+
+if TYPE_CHECKING:
+    from playwright.async_api import Page, Browser, BrowserContext
+
+# Status lines appended to assistant replies (results, failures, extracted data)
+_STATUS_LINES_RE = re.compile(r"\n\n[✅❌📋].*", re.S)
+
+# Email request parsing
+_SEND_EMAIL_RE = re.compile(r"\bsend email\b", re.I)
+_EMAIL_TO_RE = re.compile(r"to\s+([\w.\-]+@[\w.\-]+)", re.I)
+_SUBJECT_RE = re.compile(r"subject\s+['\"](.+?)['\"]", re.I)
+_BODY_RE = re.compile(r"body\s+['\"](.+?)['\"]", re.I | re.S)
+
+# Locates the top-level "response" field in a partially streamed intent reply
+_RESPONSE_FIELD_RE = re.compile(r'"response"\s*:\s*(?=")')
+_JSON_DECODER = json.JSONDecoder()
+
+# Runs a batch of fill/select ops in the page in one round-trip. Returns the index
+# of the first op it could not apply (or ops.length when all succeeded) so the
+# caller can fall back to regular Playwright actions from there. Elements that
+# aren't rendered, are disabled, or are read-only are left to that fallback so
+# Playwright's actionability checks still apply. Errors are caught per op, so the
+# evaluation itself only fails if the page goes away.
+_BATCH_DOM_OPS_JS = """(ops) => {
+    for (let i = 0; i < ops.length; i++) {
+        const o = ops[i];
+        try {
+            const el = document.querySelector(o.sel);
+            if (!el || !el.getClientRects().length || el.disabled || el.readOnly) return i;
+            if (o.op === 'select') {
+                if (!Array.from(el.options || []).some((opt) => opt.value === o.text)) return i;
+                el.value = o.text;
+            } else if (el.isContentEditable) {
+                el.textContent = o.text;
+            } else {
+                // Use the native setter so framework-controlled inputs see the change
+                const desc = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value');
+                if (desc && desc.set) desc.set.call(el, o.text); else el.value = o.text;
+            }
+            el.dispatchEvent(new Event('input', {bubbles: true}));
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+        } catch (e) {
+            return i;
+        }
+    }
+    return ops.length;
+}"""
+
+# Configure logging (set BROWSER_AGENT_DEBUG=1 for debug output, including cookie dumps)
+logging.basicConfig(level=logging.DEBUG if os.environ.get("BROWSER_AGENT_DEBUG") else logging.INFO)
 logger = logging.getLogger(__name__)
 
 class AgentState(Enum):
@@ -34,11 +89,11 @@ class AgentState(Enum):
 @dataclass
 class BrowserAction:
     """Represents a browser action to be performed"""
-    action_type: str  # click, type, navigate, scroll, wait, screenshot, select, extract, switch_frame
+    action_type: str  # click, type, navigate, scroll, wait, screenshot, select, extract, switch_frame, reload
     target: str = ""  # CSS selector, URL, or frame selector
     text: str = ""    # Text to type or select
     description: str = ""  # Human-readable description
-    delay: float = 1.0    # Delay after action
+    delay: float = 0.0    # Seconds to wait (only used by "wait" actions)
     value: Optional[Any] = None  # Additional data (e.g., for select options or extracted data)
 
 @dataclass
@@ -47,57 +102,23 @@ class ConversationMessage:
     role: str  # user, assistant, system
     content: str
     timestamp: datetime
-    screenshot: Optional[str] = None  # base64 encoded screenshot
+    screenshot: Optional[bytes] = None  # JPEG screenshot bytes
     action: Optional[BrowserAction] = None
 
-class OpenRouterClient:
-    """Client for OpenRouter API"""
-    
-    def __init__(self, api_key: str):
-        self.api_key = api_key
-        self.base_url = "https://openrouter.ai/api/v1"
-        self.headers = {
-            "Authorization": f"Bearer {api_key}",
-            "HTTP-Referer": "http://localhost:8501",
-            "X-Title": "AI Browser Agent"
-        }
-    
-    def generate_response(self, messages: List[Dict], model: str = "anthropic/claude-3.5-sonnet") -> str:
-        """Generate response using OpenRouter API"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json={
-                    "model": model,
-                    "messages": messages,
-                    "max_tokens": 1500,
-                    "temperature": 0.7
-                }
-            )
-            if response.status_code == 200:
-                return response.json()["choices"][0]["message"]["content"]
-            else:
-                logger.error(f"OpenRouter API error: {response.text}")
-                return "I apologize, but I'm having trouble processing your request right now."
-        except Exception as e:
-            logger.error(f"OpenRouter API exception: {e}")
-            return "I encountered an error while processing your request."
-    
-    def analyze_intent(self, user_input: str, conversation_history: List[Dict]) -> Dict:
-        """Analyze user intent and determine required browser actions"""
-        system_prompt = """You are an AI browser automation agent. Your job is to understand user requests and determine what browser actions are needed.
+# Static system prompt for intent analysis. Kept byte-identical across calls so
+# the provider can cache it as a prompt prefix.
+_SYSTEM_PROMPT = """You are an AI browser automation agent. Your job is to understand user requests and determine what browser actions are needed.
 
 Given a user request, analyze it and respond with a JSON object containing:
 {
     "intent": "description of what the user wants",
     "actions": [
         {
-            "action_type": "navigate|click|type|scroll|wait|screenshot|select|extract|switch_frame",
+            "action_type": "navigate|click|type|scroll|wait|screenshot|select|extract|switch_frame|reload",
             "target": "URL or CSS selector or frame selector",
             "text": "text to type or select (if applicable)",
             "description": "human-readable description of this action",
-            "value": "additional data if needed (e.g., select option value or extraction details)"
+            "value": "additional data if needed (e.g., select option value, \"all\" on extract to read every matching element, or \"networkidle\" on navigate to wait for network activity to settle)"
         }
     ],
     "requires_info": ["list of information needed from user"],
@@ -152,51 +173,243 @@ Examples:
     "response": "Extracting the main headline from BBC."
   }
 """
+
+class _ResponseFieldScanner:
+    """Incrementally extracts the "response" string from a streamed intent reply"""
+    
+    KEY_OVERLAP = 64  # Characters kept between deltas so a key split across them is found
+    
+    def __init__(self):
+        self.done = False
+        self._tail = ""  # Recent text searched for the key
+        self._value_parts: Optional[List[str]] = None  # Text from the value's opening quote
+    
+    def feed(self, delta: str) -> Optional[str]:
+        """Consume a streamed delta; return the response string once it has fully arrived"""
+        if self.done:
+            return None
+        if self._value_parts is None:
+            text = self._tail + delta
+            match = _RESPONSE_FIELD_RE.search(text)
+            if not match:
+                self._tail = text[-self.KEY_OVERLAP:]
+                return None
+            self._value_parts = [text[match.end():]]
+        else:
+            self._value_parts.append(delta)
+            if '"' not in delta:
+                return None  # The closing quote can't have arrived yet
+        try:
+            value, _ = _JSON_DECODER.raw_decode("".join(self._value_parts))
+        except json.JSONDecodeError:
+            return None  # String literal not complete yet
+        self.done = True
+        return value if isinstance(value, str) else None
+
+class OpenRouterClient:
+    """Client for OpenRouter API"""
+    
+    INTENT_CACHE_SIZE = 256  # Max cached intent analyses
+    API_ERROR_RESPONSE = "I apologize, but I'm having trouble processing your request right now."
+    API_EXCEPTION_RESPONSE = "I encountered an error while processing your request."
+    
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self.base_url = "https://openrouter.ai/api/v1"
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": "http://localhost:8501",
+            "X-Title": "AI Browser Agent"
+        }
+        # Persistent async HTTP/2 client so connections are reused across turns
+        # and the LLM round-trip doesn't block the event loop
+        self.aclient = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=httpx.Timeout(30.0, connect=3.05),
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=2,  # Retries failed connection attempts only
+                limits=httpx.Limits(max_keepalive_connections=8)
+            )
+        )
+        # LRU cache of parsed intent data, keyed by a hash of input + recent history
+        self._intent_cache: "OrderedDict[str, Dict]" = OrderedDict()
+    
+    def _intent_cache_key(self, user_input: str, conversation_history: List[Dict]) -> str:
+        """Build a stable cache key from the user input and the history sent with it"""
+        # The caller bounds the history, so hashing all of it matches the request exactly
+        history = tuple(
+            (msg.get("role", ""), msg.get("content", ""))
+            for msg in conversation_history
+        )
+        return hashlib.sha256(repr((user_input, history)).encode()).hexdigest()
+    
+    async def generate_response(
+        self,
+        messages: List[Dict],
+        model: str = "anthropic/claude-3.5-sonnet",
+        on_delta: Optional[Callable[[str], None]] = None
+    ) -> str:
+        """Generate response using OpenRouter API, streaming the completion"""
+        try:
+            async with self.aclient.stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                json={
+                    "model": model,
+                    "messages": messages,
+                    "max_tokens": 1500,
+                    "temperature": 0.7,
+                    "stream": True
+                }
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.error("OpenRouter API error: %s", response.text)
+                    return self.API_ERROR_RESPONSE
+                
+                parts = []
+                async for line in response.aiter_lines():
+                    # SSE: payload lines start with "data: "; others are keep-alive comments
+                    if not line.startswith("data: "):
+                        continue
+                    data = line[len("data: "):]
+                    if data == "[DONE]":
+                        break
+                    chunk = orjson.loads(data)
+                    if not chunk.get("choices"):
+                        continue
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        if on_delta:
+                            on_delta(delta)
+                return "".join(parts)
+        except Exception as e:
+            logger.error("OpenRouter API exception: %s", e)
+            return self.API_EXCEPTION_RESPONSE
+    
+    async def analyze_intent(
+        self,
+        user_input: str,
+        conversation_history: List[Dict],
+        on_response: Optional[Callable[[str], None]] = None
+    ) -> Dict:
+        """Analyze user intent and determine required browser actions"""
+        cache_key = self._intent_cache_key(user_input, conversation_history)
+        cached = self._intent_cache.get(cache_key)
+        if cached is not None:
+            self._intent_cache.move_to_end(cache_key)
+            logger.debug("Intent cache hit")
+            # Return a copy so callers can mutate the result freely
+            return copy.deepcopy(cached)
         
+        # Static system prompt first, then history, then the new request, so the
+        # cacheable prefix stays contiguous across turns
         messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"User request: {user_input}"}
+            {
+                "role": "system",
+                "content": [
+                    {"type": "text", "text": _SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}
+                ]
+            }
         ]
+        messages.extend(conversation_history)
+        messages.append({"role": "user", "content": f"User request: {user_input}"})
         
-        # Add conversation history for context
-        for msg in conversation_history[-5:]:  # Last 5 messages for context
-            messages.append(msg)
+        # Surface the conversational reply as soon as it has streamed in,
+        # while the rest of the JSON (the actions) is still arriving
+        on_delta = None
+        if on_response:
+            scanner = _ResponseFieldScanner()
+            
+            def on_delta(delta: str):
+                text = scanner.feed(delta)
+                if text is not None:
+                    on_response(text)
         
-        response = self.generate_response(messages)
+        response = await self.generate_response(messages, on_delta=on_delta)
         
         try:
             # Try to parse JSON response
-            intent_data = json.loads(response)
-            logger.debug(f"Intent analysis response: {intent_data}")
+            intent_data = orjson.loads(response)
+            logger.debug("Intent analysis response: %s", intent_data)
+            self._intent_cache[cache_key] = copy.deepcopy(intent_data)
+            if len(self._intent_cache) > self.INTENT_CACHE_SIZE:
+                self._intent_cache.popitem(last=False)
             return intent_data
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse OpenRouter response: {response}")
+        except (json.JSONDecodeError, ValueError):
+            logger.error("Failed to parse OpenRouter response: %s", response)
             return {
                 "intent": "unclear request",
                 "actions": [],
                 "requires_info": ["Please clarify your request with more details."],
                 "response": "I'm sorry, I didn't understand your request. Could you provide more details?"
             }
+    
+    async def summarize_history(self, messages: List[Dict]) -> str:
+        """Summarize earlier conversation turns, returning "" on failure"""
+        transcript = "\n".join(f"{msg['role']}: {msg['content']}" for msg in messages)
+        response = await self.generate_response([
+            {"role": "system", "content": "Summarize this conversation between a user and a browser automation agent in a few sentences. Keep URLs, names, and any facts needed to continue the task."},
+            {"role": "user", "content": transcript}
+        ])
+        if response in (self.API_ERROR_RESPONSE, self.API_EXCEPTION_RESPONSE):
+            return ""
+        return response
+    
+    async def close(self):
+        """Close the underlying HTTP client"""
+        try:
+            await self.aclient.aclose()
+        except Exception as e:
+            logger.error("Failed to close OpenRouter client: %s", e)
 
 class BrowserController:
     """Controls browser automation with Playwright"""
     
+    BATCH_FILL_ACTIONS = {"type": "fill", "select": "select"}  # action_type -> batch op
+    # Side-effect class per action type; consecutive "dom_read" actions run concurrently,
+    # everything else (and unknown types) runs strictly in order
+    ACTION_SIDE_EFFECTS = {
+        "navigate": "nav",
+        "reload": "nav",
+        "switch_frame": "nav",
+        "click": "dom_write",
+        "type": "dom_write",
+        "select": "dom_write",
+        "scroll": "dom_write",
+        "wait": "io",
+        "extract": "dom_read",
+        "screenshot": "dom_read"
+    }
+    SELECTOR_TIMEOUT = 10000  # ms to wait for a target element
+    RETRY_SELECTOR_TIMEOUT = 20000  # ms for the single retry after a selector timeout
+    SCREENSHOT_MAX_AGE = 2.0  # Seconds a cached screenshot may be reused
+    
     def __init__(self):
-        self.browser: Optional[Browser] = None
-        self.context: Optional[BrowserContext] = None
-        self.page: Optional[Page] = None
+        self.browser: Optional["Browser"] = None
+        self.context: Optional["BrowserContext"] = None
+        self.page: Optional["Page"] = None
         self.playwright = None
         self.is_initialized = False
         self.current_frame = None
         self.user_data_dir = Path("./browser_data")  # Directory for persistent context
+        # Last screenshot, reused while the page URL and DOM are unchanged
+        self._dom_mutation_counter = 0
+        self._last_shot_key: Optional[Tuple[str, int]] = None
+        self._last_shot_bytes = b""
+        self._last_shot_time = 0.0
         
     async def initialize(self, headless: bool = False):
         """Initialize browser with persistent context"""
         try:
+            from playwright.async_api import async_playwright
+            
             self.playwright = await async_playwright().start()
             # Create user data directory if it doesn't exist
             os.makedirs(self.user_data_dir, exist_ok=True)
-            logger.debug(f"User data directory created at: {self.user_data_dir}")
+            logger.debug("User data directory created at: %s", self.user_data_dir)
             
             try:
                 # Launch browser with persistent context
@@ -215,7 +428,7 @@ class BrowserController:
                 )
                 logger.info("Successfully launched Chrome browser with persistent context")
             except Exception as chrome_error:
-                logger.warning(f"Failed to launch Chrome browser: {chrome_error}. Falling back to bundled Chromium.")
+                logger.warning("Failed to launch Chrome browser: %s. Falling back to bundled Chromium.", chrome_error)
                 self.context = await self.playwright.chromium.launch_persistent_context(
                     user_data_dir=self.user_data_dir,
                     headless=headless,
@@ -232,76 +445,121 @@ class BrowserController:
             
             self.page = await self.context.new_page()
             self.is_initialized = True
-            # Log cookies to verify session persistence
-            cookies = await self.context.cookies()
-            logger.debug(f"Initial cookies in context: {cookies}")
+            # Log cookies to verify session persistence (a CDP round-trip, so debug only)
+            if logger.isEnabledFor(logging.DEBUG):
+                cookies = await self.context.cookies()
+                logger.debug("Initial cookies in context: %s", cookies)
             logger.info("Browser initialized successfully with persistent context")
             
         except Exception as e:
-            logger.error(f"Failed to initialize browser: {e}")
+            logger.error("Failed to initialize browser: %s", e)
             raise e
     
-    async def take_screenshot(self) -> str:
-        """Take screenshot and return base64 encoded string"""
+    async def take_screenshot_bytes(self) -> bytes:
+        """Take viewport screenshot and return the JPEG bytes"""
         if not self.page:
-            return ""
+            return b""
             
+        # The page's own scripts can change it at any time, so only reuse recent captures
+        key = (self.page.url, self._dom_mutation_counter)
+        if key == self._last_shot_key and time.monotonic() - self._last_shot_time < self.SCREENSHOT_MAX_AGE:
+            return self._last_shot_bytes
+        
         try:
-            screenshot_bytes = await self.page.screenshot(full_page=True, timeout=10000)
-            screenshot_b64 = base64.b64encode(screenshot_bytes).decode()
-            return screenshot_b64
+            # Viewport JPEG straight from the browser: far smaller than a full-page
+            # PNG and needs no re-encoding
+            screenshot_bytes = await self.page.screenshot(
+                full_page=False,
+                type="jpeg",
+                quality=70,
+                timeout=10000
+            )
+            self._last_shot_key = key
+            self._last_shot_bytes = screenshot_bytes
+            self._last_shot_time = time.monotonic()
+            return screenshot_bytes
         except Exception as e:
-            logger.error(f"Failed to take screenshot: {e}")
-            return ""
+            logger.error("Failed to take screenshot: %s", e)
+            return b""
     
-    async def execute_action(self, action: BrowserAction) -> Tuple[bool, str]:
+    async def execute_action(self, action: BrowserAction, timeout: int = SELECTOR_TIMEOUT) -> Tuple[bool, str]:
         """Execute a browser action"""
         if not self.page:
             return False, "Browser not initialized"
         
+        # Already loaded by initialize(); imported here to keep module import light
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+        
+        # Invalidate the cached screenshot for anything that may change the page; a wait
+        # exists to let the page change, and an explicit screenshot must be fresh
+        if (self.ACTION_SIDE_EFFECTS.get(action.action_type) in ("nav", "dom_write")
+                or action.action_type in ("wait", "screenshot")):
+            self._dom_mutation_counter += 1
+        
+        previous_url = self.page.url
+        # Set once the element is there, so a timeout in the action itself isn't replayed
+        selector_found = False
         try:
             if action.action_type == "navigate":
                 await self.page.goto(action.target, timeout=30000)
                 await self.page.wait_for_load_state("domcontentloaded", timeout=30000)
-                # Log cookies after navigation
-                cookies = await self.context.cookies()
-                logger.debug(f"Cookies after navigation to {action.target}: {cookies}")
+                if action.value == "networkidle":
+                    try:
+                        await self.page.wait_for_load_state("networkidle", timeout=5000)
+                    except Exception as e:
+                        logger.debug("Network did not settle after navigating to %s: %s", action.target, e)
+                # Log cookies after navigation (a CDP round-trip, so debug only)
+                if logger.isEnabledFor(logging.DEBUG):
+                    cookies = await self.context.cookies()
+                    logger.debug("Cookies after navigation to %s: %s", action.target, cookies)
                 return True, f"Navigated to {action.target}"
                 
             elif action.action_type == "click":
-                await self.page.wait_for_selector(action.target, timeout=10000)
-                await self.page.click(action.target)
+                await self.page.wait_for_selector(action.target, timeout=timeout)
+                selector_found = True
+                await self.page.click(action.target, timeout=timeout)
                 return True, f"Clicked on {action.target}"
                 
+            elif action.action_type == "reload":
+                await self.page.reload(timeout=30000)
+                return True, "Reloaded page"
+                
             elif action.action_type == "type":
-                await self.page.wait_for_selector(action.target, timeout=10000)
-                await self.page.fill(action.target, action.text)
+                await self.page.wait_for_selector(action.target, timeout=timeout)
+                selector_found = True
+                await self.page.fill(action.target, action.text, timeout=timeout)
                 return True, f"Typed '{action.text}' into {action.target}"
                 
             elif action.action_type == "scroll":
                 if action.target:
-                    await self.page.locator(action.target).scroll_into_view_if_needed(timeout=10000)
+                    await self.page.locator(action.target).scroll_into_view_if_needed(timeout=timeout)
                     return True, f"Scrolled to element {action.target}"
                 else:
                     await self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
                     return True, "Scrolled to bottom of page"
                 
             elif action.action_type == "wait":
-                await self.page.wait_for_timeout(int(action.delay * 1000))
-                return True, f"Waited for {action.delay} seconds"
+                delay = action.delay if action.delay > 0 else 1.0
+                await self.page.wait_for_timeout(int(delay * 1000))
+                return True, f"Waited for {delay} seconds"
                 
             elif action.action_type == "screenshot":
                 return True, "Screenshot taken"
                 
             elif action.action_type == "select":
-                await self.page.wait_for_selector(action.target, timeout=10000)
-                await self.page.select_option(action.target, value=action.text)
+                await self.page.wait_for_selector(action.target, timeout=timeout)
+                selector_found = True
+                await self.page.select_option(action.target, value=action.text, timeout=timeout)
                 return True, f"Selected option '{action.text}' in {action.target}"
                 
             elif action.action_type == "extract":
-                await self.page.wait_for_selector(action.target, timeout=10000)
-                element = await self.page.query_selector(action.target)
-                text = await element.text_content() if element else ""
+                locator = self.page.locator(action.target)
+                if action.value == "all":
+                    await locator.first.wait_for(timeout=timeout)
+                    text = "\n".join(await locator.all_inner_texts())
+                else:
+                    # Waits for and reads the element in a single call
+                    text = await locator.first.inner_text(timeout=timeout)
                 return True, f"Extracted text: {text}"
                 
             elif action.action_type == "switch_frame":
@@ -312,13 +570,100 @@ class BrowserController:
             else:
                 return False, f"Unknown action type: {action.action_type}"
                 
+        except PlaywrightTimeoutError as e:
+            if action.action_type == "navigate":
+                # A timeout before the navigation commits leaves the old page in place
+                current_url = self.page.url
+                if current_url == previous_url and current_url.rstrip("/") != action.target.rstrip("/"):
+                    logger.error("Navigation to %s never committed: %s", action.target, e)
+                    return False, f"Action failed: {str(e)}"
+                # The page may be usable even though it never finished loading
+                try:
+                    await self.page.wait_for_load_state("domcontentloaded", timeout=5000)
+                    logger.warning("Navigation to %s timed out but the page is usable: %s", action.target, e)
+                    return True, f"Navigated to {action.target} (page still loading)"
+                except Exception:
+                    logger.error("Navigation failed: %s", e)
+                    return False, f"Action failed: {str(e)}"
+            if (action.action_type in ("click", "type", "select", "scroll", "extract")
+                    and not selector_found and timeout < self.RETRY_SELECTOR_TIMEOUT):
+                # Usually a slow element rather than a wrong selector; retry once with a longer wait
+                logger.warning("Action timed out, retrying with a longer wait: %s", e)
+                return await self.execute_action(action, timeout=self.RETRY_SELECTOR_TIMEOUT)
+            logger.error("Action execution failed: %s", e)
+            return False, f"Action failed: {str(e)}"
         except Exception as e:
-            logger.error(f"Action execution failed: {e}")
-            try:
-                await self.page.reload(timeout=30000)
-                return False, f"Action failed: {str(e)}. Page reloaded for retry."
-            except:
-                return False, f"Action failed: {str(e)}. Could not recover."
+            logger.error("Action execution failed: %s", e)
+            if self.page.is_closed():
+                try:
+                    self.page = await self.context.new_page()
+                    return False, f"Action failed: {str(e)}. Page was closed; opened a new one."
+                except Exception:
+                    return False, f"Action failed: {str(e)}. Could not recover."
+            return False, f"Action failed: {str(e)}"
+    
+    def _next_batch(self, actions: List[BrowserAction], start: int) -> int:
+        """Return the end index of the batchable run beginning at start"""
+        # Consecutive type/select actions only; clicks go through page.click, which
+        # waits for any navigation they start
+        end = start
+        while end < len(actions) and actions[end].action_type in self.BATCH_FILL_ACTIONS:
+            end += 1
+        return end
+    
+    async def execute_action_batch(self, actions: List[BrowserAction]) -> List[Tuple[bool, str]]:
+        """Execute actions in order, running form-fill runs in a single page evaluation"""
+        # Stops after the first failure; results line up with the attempted actions
+        results: List[Tuple[bool, str]] = []
+        i = 0
+        while i < len(actions):
+            # Independent reads on a settled page can overlap
+            end = i
+            while end < len(actions) and self.ACTION_SIDE_EFFECTS.get(actions[end].action_type) == "dom_read":
+                end += 1
+            if end - i >= 2:
+                group = await asyncio.gather(*(self.execute_action(action) for action in actions[i:end]))
+                for success, result in group:
+                    results.append((success, result))
+                    if not success:
+                        return results
+                i = end
+                continue
+            
+            end = self._next_batch(actions, i) if self.page else i
+            if end - i >= 2:
+                run = actions[i:end]
+                ops = [
+                    {
+                        "sel": action.target,
+                        "op": self.BATCH_FILL_ACTIONS[action.action_type],
+                        "text": action.text
+                    }
+                    for action in run
+                ]
+                self._dom_mutation_counter += 1
+                try:
+                    applied = await self.page.evaluate(_BATCH_DOM_OPS_JS, ops)
+                except Exception as e:
+                    # The script catches its own errors, so no op ran
+                    logger.debug("Batched actions failed, falling back to single actions: %s", e)
+                    applied = 0
+                for action in run[:applied]:
+                    if action.action_type == "type":
+                        results.append((True, f"Typed '{action.text}' into {action.target}"))
+                    else:
+                        results.append((True, f"Selected option '{action.text}' in {action.target}"))
+                # Continue with regular actions from the first op that wasn't applied
+                i += applied
+                if applied == len(run):
+                    continue
+            
+            success, result = await self.execute_action(actions[i])
+            results.append((success, result))
+            if not success:
+                break
+            i += 1
+        return results
     
     async def get_page_info(self) -> Dict:
         """Get current page information"""
@@ -332,7 +677,7 @@ class BrowserController:
                 "ready_state": await self.page.evaluate("document.readyState")
             }
         except Exception as e:
-            logger.error(f"Failed to get page info: {e}")
+            logger.error("Failed to get page info: %s", e)
             return {}
     
     async def cleanup(self):
@@ -347,16 +692,24 @@ class BrowserController:
             self.is_initialized = False
             logger.info("Browser cleanup completed")
         except Exception as e:
-            logger.error(f"Browser cleanup failed: {e}")
+            logger.error("Browser cleanup failed: %s", e)
 
 class ConversationalBrowserAgent:
     """Main conversational browser agent"""
     
+    LLM_HISTORY_TOKEN_BUDGET = 2000  # Approximate token cap for history sent to the LLM
+    LLM_HISTORY_MAX_MESSAGES = 6  # Hard cap on prior messages sent with each request
+    LLM_HISTORY_KEEP_RECENT = 4  # Messages kept verbatim when older ones are summarized
+    
     def __init__(self, openrouter_api_key: str):
         self.openrouter = OpenRouterClient(openrouter_api_key)
         self.browser = BrowserController()
         self.state = AgentState.IDLE
-        self.conversation_history: List[Dict] = []
+        self.conversation_history_full: List[Dict] = []  # Everything, as shown to the user
+        self.conversation_history_llm: List[Dict] = []  # Compact history sent to the LLM
+        # Background summary of the oldest LLM history messages, applied on a later turn
+        self._summary_task: Optional[asyncio.Task] = None
+        self._summary_covers = 0
         self.current_task = None
         self.task_context = {}
         
@@ -364,18 +717,80 @@ class ConversationalBrowserAgent:
         """Initialize the agent"""
         await self.browser.initialize(headless=False)
         self.state = AgentState.IDLE
+    
+    @staticmethod
+    def _parse_delay(value: Any) -> float:
+        """Parse the planner's delay (seconds), falling back to 0 for malformed values"""
+        try:
+            return max(float(value or 0.0), 0.0)
+        except (TypeError, ValueError):
+            logger.warning("Ignoring invalid action delay: %r", value)
+            return 0.0
+    
+    @staticmethod
+    def _estimate_tokens(messages: List[Dict]) -> int:
+        """Cheap token estimate (~4 characters per token)"""
+        return sum(len(msg["content"]) for msg in messages) // 4
+    
+    def _start_history_summary(self):
+        """Summarize older LLM history in the background once it exceeds the token budget"""
+        # Only the token budget triggers a summary; the per-request message cap is
+        # applied when the history is sent, so it needs no extra LLM calls
+        history = self.conversation_history_llm
+        if self._summary_task is not None or len(history) <= self.LLM_HISTORY_KEEP_RECENT:
+            return
+        if self._estimate_tokens(history) <= self.LLM_HISTORY_TOKEN_BUDGET:
+            return
         
-    async def process_user_input(self, user_input: str) -> ConversationMessage:
+        # Runs off the critical path; the result is swapped in on a later turn
+        older = history[:-self.LLM_HISTORY_KEEP_RECENT]
+        self._summary_covers = len(older)
+        self._summary_task = asyncio.create_task(self.openrouter.summarize_history(older))
+    
+    def _apply_history_summary(self):
+        """Replace the messages covered by a finished background summary"""
+        task = self._summary_task
+        if task is None or not task.done():
+            return
+        self._summary_task = None
+        try:
+            summary = task.result()
+        except Exception as e:
+            logger.error("History summarization failed: %s", e)
+            summary = ""
+        
+        # Only appends happen while the summary runs, so the covered prefix is unchanged
+        before = len(self.conversation_history_llm)
+        remaining = self.conversation_history_llm[self._summary_covers:]
+        if summary and remaining:
+            # Fold the summary into the next message so roles keep alternating;
+            # if summarization failed the older messages are simply dropped
+            first = remaining[0]
+            remaining[0] = {
+                "role": first["role"],
+                "content": f"Summary of earlier conversation: {summary}\n\n{first['content']}"
+            }
+        self.conversation_history_llm = remaining
+        logger.debug("Compacted LLM history from %s to %s messages", before, len(remaining))
+        
+    async def process_user_input(
+        self,
+        user_input: str,
+        on_response: Optional[Callable[[str], None]] = None
+    ) -> ConversationMessage:
         """Process user input and return response with potential screenshot"""
         
+        self._apply_history_summary()
+        
         # Add user message to history
-        self.conversation_history.append({
-            "role": "user",
-            "content": user_input
-        })
+        user_msg = {"role": "user", "content": user_input}
+        self.conversation_history_full.append(user_msg)
+        self.conversation_history_llm.append(dict(user_msg))
+        
+        is_email_task = _SEND_EMAIL_RE.search(user_input) is not None
         
         # Check for email credentials if needed
-        if "send email" in user_input.lower() and not self.task_context.get("email_credentials"):
+        if is_email_task and not self.task_context.get("email_credentials"):
             self.state = AgentState.WAITING_FOR_INPUT
             return ConversationMessage(
                 role="assistant",
@@ -384,11 +799,11 @@ class ConversationalBrowserAgent:
             )
         
         # Check for email details if credentials are provided
-        if "send email" in user_input.lower() and self.task_context.get("email_credentials"):
+        if is_email_task and self.task_context.get("email_credentials"):
             # Parse user input for email details (basic parsing, improve as needed)
-            recipient = re.search(r"to\s+([\w\.-]+@[\w\.-]+)", user_input)
-            subject = re.search(r"subject\s+['\"](.+?)['\"]", user_input)
-            body = re.search(r"body\s+['\"](.+?)['\"]", user_input)
+            recipient = _EMAIL_TO_RE.search(user_input)
+            subject = _SUBJECT_RE.search(user_input)
+            body = _BODY_RE.search(user_input)
             
             if not (recipient and subject and body):
                 self.state = AgentState.WAITING_FOR_INPUT
@@ -403,9 +818,21 @@ class ConversationalBrowserAgent:
                 "body": body.group(1)
             }
         
-        # Analyze intent
+        # Analyze intent, capturing the current page while the LLM call is in flight.
+        # The previous page is therefore already captured before any navigation in
+        # the plan starts, so navigations never wait on a screenshot of it.
         self.state = AgentState.THINKING
-        intent_data = self.openrouter.analyze_intent(user_input, self.conversation_history)
+        # Prior messages only (this turn is appended last by analyze_intent), capped
+        # even while a background summary is pending
+        llm_history = self.conversation_history_llm[-(self.LLM_HISTORY_MAX_MESSAGES + 1):-1]
+        if self.browser.is_initialized:
+            intent_data, page_screenshot = await asyncio.gather(
+                self.openrouter.analyze_intent(user_input, llm_history, on_response),
+                self.browser.take_screenshot_bytes()
+            )
+        else:
+            intent_data = await self.openrouter.analyze_intent(user_input, llm_history, on_response)
+            page_screenshot = None
         
         # Check if we need more information
         if intent_data.get("requires_info"):
@@ -419,22 +846,23 @@ class ConversationalBrowserAgent:
         
         # Execute browser actions
         self.state = AgentState.ACTING
-        response_content = intent_data["response"]
-        screenshot = None
+        response_parts = [intent_data["response"]]
         extracted_data = []
         
         if intent_data.get("actions"):
+            actions = []
             for action_data in intent_data["actions"]:
                 action = BrowserAction(
                     action_type=action_data["action_type"],
                     target=action_data.get("target", ""),
                     text=action_data.get("text", ""),
                     description=action_data.get("description", ""),
+                    delay=self._parse_delay(action_data.get("delay")),
                     value=action_data.get("value", None)
                 )
                 
                 # Override action text with stored credentials for email tasks
-                if "send email" in user_input.lower() and self.task_context.get("email_credentials"):
+                if is_email_task and self.task_context.get("email_credentials"):
                     if action.target == "input#identifierId":
                         action.text = self.task_context["email_credentials"].get("email", "")
                     elif action.target == "input[type='password']":
@@ -445,38 +873,45 @@ class ConversationalBrowserAgent:
                         action.text = self.task_context["email_details"].get("subject", "")
                     elif action.target == "div[aria-label='Message Body']":
                         action.text = self.task_context["email_details"].get("body", "")
-                
-                # Execute the action
-                success, result = await self.browser.execute_action(action)
-                
+                actions.append(action)
+            
+            # Execute the actions, batching form fills into single page evaluations
+            results = await self.browser.execute_action_batch(actions)
+            
+            for action, (success, result) in zip(actions, results):
                 if success:
-                    response_content += f"\n\n✅ {action.description}: {result}"
+                    response_parts.append(f"\n\n✅ {action.description}: {result}")
                     if action.action_type == "extract":
                         extracted_data.append(result)
-                    # Take screenshot after significant actions
-                    if action.action_type in ["navigate", "click", "type", "select", "switch_frame"]:
-                        screenshot = await self.browser.take_screenshot()
                 else:
-                    response_content += f"\n\n❌ Failed: {result}"
+                    response_parts.append(f"\n\n❌ Failed: {result}")
                     self.state = AgentState.ERROR
                     break
-                
-                # Add delay between actions
-                await asyncio.sleep(action.delay)
         
-        # Take final screenshot if we don't have one
-        if not screenshot and self.browser.is_initialized:
-            screenshot = await self.browser.take_screenshot()
+        if intent_data.get("actions") and self.browser.is_initialized:
+            # Take a single screenshot once the plan has finished (or failed)
+            screenshot = await self.browser.take_screenshot_bytes()
+        else:
+            # Reuse the pre-analysis capture, since no action touched the page
+            screenshot = page_screenshot
         
         # Add extracted data to response if any
         if extracted_data:
-            response_content += "\n\n📋 Extracted Data:\n" + "\n".join(extracted_data)
+            response_parts.append("\n\n📋 Extracted Data:\n")
+            response_parts.append("\n".join(extracted_data))
+        response_content = "".join(response_parts)
         
-        # Add assistant response to history
-        self.conversation_history.append({
+        # Add assistant response to history; the LLM only needs the conversational
+        # part, not the per-action status lines and extracted data
+        self.conversation_history_full.append({
             "role": "assistant",
             "content": response_content
         })
+        self.conversation_history_llm.append({
+            "role": "assistant",
+            "content": _STATUS_LINES_RE.sub("", response_content)
+        })
+        self._start_history_summary()
         
         self.state = AgentState.IDLE
         
@@ -489,11 +924,17 @@ class ConversationalBrowserAgent:
     
     async def cleanup(self):
         """Clean up resources"""
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            self._summary_task = None
         await self.browser.cleanup()
+        await self.openrouter.close()
 
 class BrowserAgentApp:
     """Streamlit application for the browser agent"""
     
+    MAX_SCREENSHOTS = 3  # Screenshots retained in the chat history
+    
     def __init__(self):
         self.agent: Optional[ConversationalBrowserAgent] = None
         
@@ -504,16 +945,43 @@ class BrowserAgentApp:
             st.session_state.agent_initialized = False
         if 'agent' not in st.session_state:
             st.session_state.agent = None
+        if 'loop' not in st.session_state:
+            # One event loop per session, kept alive across reruns so Playwright and
+            # the HTTP client stay bound to the loop they were created on
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, daemon=True).start()
+            st.session_state.loop = loop
     
-    async def run_coroutine(self, coro):
+    def submit_coroutine(self, coro):
+        """Schedule a coroutine on the session's event loop and return its future"""
+        return asyncio.run_coroutine_threadsafe(coro, st.session_state.loop)
+    
+    def run_coroutine(self, coro, while_waiting: Optional[Callable[[], None]] = None):
         """Helper function to run async coroutines in Streamlit"""
+        future = self.submit_coroutine(coro)
         try:
-            return await coro
+            # Streamlit calls must come from the script thread, so UI updates are
+            # pumped here while the coroutine runs on the loop thread
+            if while_waiting:
+                while not future.done():
+                    while_waiting()
+            return future.result()
         except Exception as e:
-            logger.error(f"Error running coroutine: {e}")
+            logger.error("Error running coroutine: %s", e)
             st.error(f"Error: {e}")
             return None
     
+    def evict_old_screenshots(self):
+        """Drop screenshots from all but the most recent messages to bound memory"""
+        kept = 0
+        for message in reversed(st.session_state.messages):
+            if message.get("screenshot_bytes") is None:
+                continue
+            if kept < self.MAX_SCREENSHOTS:
+                kept += 1
+            else:
+                message["screenshot_bytes"] = None
+    
     def run(self):
         """Run the Streamlit application"""
         
@@ -591,11 +1059,11 @@ class BrowserAgentApp:
                                     "password": gmail_password
                                 }
                             # Initialize browser asynchronously
-                            asyncio.run(agent.initialize())
+                            self.submit_coroutine(agent.initialize()).result()
                             st.success("✅ Agent initialized! Start chatting below.")
                         except Exception as e:
                             st.error(f"❌ Failed to initialize agent: {e}")
-                            logger.error(f"Agent initialization failed: {e}")
+                            logger.error("Agent initialization failed: %s", e)
                 else:
                     st.error("Please provide OpenRouter API key")
             
@@ -605,14 +1073,14 @@ class BrowserAgentApp:
                     try:
                         if st.session_state.agent.browser.is_initialized:
                             # Run cleanup asynchronously
-                            asyncio.run(self.run_coroutine(st.session_state.agent.cleanup()))
+                            self.run_coroutine(st.session_state.agent.cleanup())
                         shutil.rmtree(st.session_state.agent.browser.user_data_dir, ignore_errors=True)
                         st.success("✅ Browser data cleared. Next session will be fresh.")
                         st.session_state.agent_initialized = False
                         st.session_state.agent = None
                     except Exception as e:
                         st.error(f"❌ Failed to clear browser data: {e}")
-                        logger.error(f"Failed to clear browser data: {e}")
+                        logger.error("Failed to clear browser data: %s", e)
             
             # Status indicator
             if st.session_state.agent_initialized:
@@ -652,15 +1120,14 @@ class BrowserAgentApp:
                     """, unsafe_allow_html=True)
                     
                     # Display screenshot if available
-                    if message.get("screenshot"):
+                    if message.get("screenshot_bytes"):
                         st.markdown("**📸 Live Screenshot:**")
                         try:
-                            img_data = base64.b64decode(message["screenshot"])
-                            img = Image.open(io.BytesIO(img_data))
-                            st.image(img, caption="Browser Screenshot", use_column_width=True)
+                            # st.image takes the encoded bytes directly; no decode needed
+                            st.image(message["screenshot_bytes"], caption="Browser Screenshot", use_column_width=True)
                         except Exception as e:
                             st.error(f"Failed to display screenshot: {e}")
-                            logger.error(f"Failed to display screenshot: {e}")
+                            logger.error("Failed to display screenshot: %s", e)
         
         # Chat input
         user_input = st.chat_input("Type your command here... (e.g., 'Go to Google and search for Python tutorials')")
@@ -679,8 +1146,22 @@ class BrowserAgentApp:
             # Process with agent
             with st.spinner("🤖 Agent is working..."):
                 try:
-                    # Process user input asynchronously
-                    response = asyncio.run(self.run_coroutine(st.session_state.agent.process_user_input(user_input)))
+                    # Show the agent's reply as soon as it streams in, before actions finish
+                    reply_placeholder = st.empty()
+                    replies = queue.Queue()
+                    
+                    def show_streamed_reply():
+                        try:
+                            text = replies.get(timeout=0.05)
+                        except queue.Empty:
+                            return
+                        reply_placeholder.markdown(f"**🤖 Agent:** {text}")
+                    
+                    # Process user input on the session's event loop
+                    response = self.run_coroutine(
+                        st.session_state.agent.process_user_input(user_input, replies.put),
+                        while_waiting=show_streamed_reply
+                    )
                     if response:
                         # Add agent response
                         message_data = {
@@ -690,16 +1171,17 @@ class BrowserAgentApp:
                         }
                         
                         if response.screenshot:
-                            message_data["screenshot"] = response.screenshot
+                            message_data["screenshot_bytes"] = response.screenshot
                         
                         st.session_state.messages.append(message_data)
+                        self.evict_old_screenshots()
                         
                         # Rerun to show the new message
                         st.rerun()
                     
                 except Exception as e:
                     st.error(f"❌ Error processing command: {e}")
-                    logger.error(f"Error in main chat loop: {e}")
+                    logger.error("Error in main chat loop: %s", e)
         
         # Footer
         st.markdown("---")